@@ -0,0 +1,133 @@
+# Copyright 2022 The Wordcab Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Startup benchmark.
+
+Measures, in fresh interpreters, the import time of the bot modules and the time to ready,
+i.e. the time from the interpreter start until the client has connected its database,
+started its background tasks and registered its commands. The Discord login and the
+command sync are network bound and not included.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 10] [--importtime]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import List
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = [
+    "discord_tldr.compaction",
+    "discord_tldr.database",
+    "discord_tldr.summarize",
+    "discord_tldr.__main__",
+]
+
+IMPORT_SCRIPT = """
+import time
+started = time.perf_counter()
+import {module}
+print(time.perf_counter() - started)
+"""
+
+READY_SCRIPT = """
+import time
+started = time.perf_counter()
+
+import asyncio
+from aiohttp import ClientSession
+from discord_tldr.__main__ import WordcabBot
+
+
+async def ready():
+    async with ClientSession() as web_client:
+        async with WordcabBot(web_client=web_client) as client:
+            await client.prepare()
+            elapsed = time.perf_counter() - started
+            await client.close()
+    return elapsed
+
+
+print(asyncio.run(ready()))
+"""
+
+
+def run_script(script: str, database_volume: str) -> float:
+    """Run a script in a fresh interpreter and return the duration it prints."""
+    env = dict(os.environ, DATABASE_VOLUME=database_volume, PYTHONPATH=REPO_ROOT)
+    output = subprocess.run(
+        [sys.executable, "-c", script], check=True, capture_output=True, text=True, env=env, cwd=REPO_ROOT
+    )
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def report(name: str, durations: List[float]) -> None:
+    """Print the statistics of a benchmark."""
+    print(
+        f"{name:<32} median {statistics.median(durations) * 1000:8.1f} ms"
+        f"   min {min(durations) * 1000:8.1f} ms   max {max(durations) * 1000:8.1f} ms"
+    )
+
+
+def print_slowest_imports(module: str, database_volume: str, count: int = 15) -> None:
+    """Print the slowest imports of a module, as reported by `python -X importtime`."""
+    env = dict(os.environ, DATABASE_VOLUME=database_volume, PYTHONPATH=REPO_ROOT)
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        capture_output=True,
+        text=True,
+        env=env,
+        cwd=REPO_ROOT,
+    )
+    imports = []
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((int(cumulative), name.strip()))
+
+    print(f"\nSlowest imports of {module} (cumulative):")
+    for cumulative, name in sorted(imports, reverse=True)[:count]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+
+def main() -> None:
+    """Run the benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="Number of fresh interpreters per benchmark.")
+    parser.add_argument("--importtime", action="store_true", help="Print the slowest imports of the bot.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as database_volume:
+        for module in MODULES:
+            durations = [run_script(IMPORT_SCRIPT.format(module=module), database_volume) for _ in range(args.runs)]
+            report(f"import {module}", durations)
+
+        durations = [run_script(READY_SCRIPT, database_volume) for _ in range(args.runs)]
+        report("time to ready", durations)
+
+        if args.importtime:
+            print_slowest_imports("discord_tldr.__main__", database_volume)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,23 +14,31 @@
 
 import asyncio
 import logging
-import logging.handlers
 import os
 from aiohttp import ClientSession
-from datetime import datetime
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from typing import List, Optional
+from typing import Coroutine, Dict, List, Optional, Set
 
 import discord
 from discord import app_commands
-from discord.ext import commands
 
-from wordcab import delete_job, retrieve_job, retrieve_summary
-
-from .authentication import login, logout
+from .authentication import credential_validator, login, logout
 from .database import bot_db
-from .metrics import UsageTracking
-from .summarize import summarize
+from .history import tldr_history
+from .jobs import JobSweeper
+from .logs import parse_log_level, parse_sample_rates, setup_logging
+from .metrics import LoopLagTracking, UsageTracking
+from .summarize import summarize, summarize_channels
+from .watchdog import LoopWatchdog
+
+
+logger = logging.getLogger("discord")
+
+
+CREDENTIALS_REVALIDATION_INTERVAL = 30 * 60  # 30 minutes
+CREDENTIALS_REVOCATION_FAILURES = 3
+SUMMARY_PRUNING_INTERVAL = 60 * 60  # 1 hour
 
 
 class WordcabBot(discord.Client):
@@ -52,11 +60,22 @@ class WordcabBot(discord.Client):
         self.web_client = web_client
         self.testing_guild_id = testing_guild_id
         self.tree = app_commands.CommandTree(self)
+        self.watchdog = LoopWatchdog(
+            threshold=float(os.getenv("LOOP_LAG_THRESHOLD", 0.25)),
+            lag_tracking=LoopLagTracking(),
+        )
+        self.summary_retention_days = int(os.getenv("SUMMARY_RETENTION_DAYS", 90))
+        self.pruning_task: Optional[asyncio.Task] = None
+        self.revalidation_task: Optional[asyncio.Task] = None
+        self.credential_failures: Dict[int, int] = {}
+        self.delivery_tasks: Set[asyncio.Task] = set()
+        self.job_sweeper = JobSweeper()
+        self.sweeper_task: Optional[asyncio.Task] = None
 
 
     async def on_ready(self):
         await self.wait_until_ready()
-        print(f'Logged on as {self.user}!')
+        logger.info("Logged on as %s!", self.user)
 
     
     async def on_guild_join(self, guild: discord.Guild):
@@ -81,6 +100,9 @@ class WordcabBot(discord.Client):
         job_name: str,
         token: str,
         summarized_chat: Optional[List[str]] = None,
+        channel_id: Optional[int] = None,
+        channel_name: Optional[str] = None,
+        channel_ids: Optional[List[int]] = None,
     ) -> None:
         """
         Send summary as DM.
@@ -103,68 +125,179 @@ class WordcabBot(discord.Client):
             The Wordcab API token.
         summarized_chat: Optional[List[str]]
             The summarized chat to send if the user requested it.
+        channel_id: Optional[int]
+            The id of the summarized channel, if the summary covers a single channel.
+        channel_name: Optional[str]
+            The name of the summarized channel, used in the summary archive.
+        channel_ids: Optional[List[int]]
+            The ids of every summarized channel and thread, used to check who can read the archived summary.
         """
+        from wordcab import retrieve_job, retrieve_summary
+
+        try:
+            while True:
+                job = retrieve_job(job_name=job_name, api_key=token)
+                status = job.job_status
+                if status == "SummaryComplete":
+                    break
+                elif status == "Deleted" or status == "Error":
+                    await user.send(f"Your job has been [{status}]. Please try again.")
+                    return
+                await asyncio.sleep(3)
+
+            summary_id = job.summary_details["summary_id"]
+            summary = retrieve_summary(summary_id=summary_id, api_key=token)
+            utterances = [utterance.summary for utterance in summary.summary[summary_size]["structured_summary"]]
+            await bot_db.archive_summary(
+                discord_guild_id=guild.id,
+                summary_id=summary_id,
+                channel_id=channel_id,
+                channel_name=channel_name,
+                channel_ids=channel_ids,
+                summary_text="\n".join(utterances),
+                summary_size=summary_size,
+                language=language,
+                timeframe=timeframe,
+            )
+            await user.send(f"**Your summary:**")
+            for utterance in utterances:
+                await user.send(f"```{utterance}```")
+
+            if summarized_chat is not None:
+                await user.send("**Chats used for the summary:**")
+                # Send the summarized chat in chunks of 2000 characters
+                joined_chat: str = ""
+                for chat in summarized_chat:
+                    if len(joined_chat) + len(chat) > 2000:
+                        await user.send(f"```{joined_chat}```")
+                        joined_chat = ""
+                    joined_chat += f"\n{chat}"
+                await user.send(f"```{joined_chat}```")
+
+            include_chat = True if summarized_chat is not None else False
+            time_started = datetime.strptime(summary.time_started, "%Y-%m-%dT%H:%M:%S.%fZ")
+            time_completed = datetime.strptime(summary.time_completed, "%Y-%m-%dT%H:%M:%S.%fZ")
+            response_time = (time_completed - time_started).total_seconds()
+            self.usage_tracking.log_metrics(
+                user=user.name,
+                guild_name=guild.name,
+                summary_size=summary_size,
+                timeframe=timeframe,
+                language=language,
+                include_chat=include_chat,
+                time_started=time_started,
+                time_completed=time_completed,
+                response_time=response_time,
+            )
+        finally:
+            # Let the job sweeper delete the job and users data, even if the delivery failed
+            await bot_db.release_job(job_name)
+
+
+    async def prune_summary_archive(self) -> None:
+        """Periodically delete the archived summaries older than the retention period."""
         while True:
-            job = retrieve_job(job_name=job_name, api_key=token)
-            status = job.job_status
-            if status == "SummaryComplete":
-                break
-            elif status == "Deleted" or status == "Error":
-                await user.send(f"Your job has been [{status}]. Please try again.")
-            await asyncio.sleep(3)
-
-        summary_id = job.summary_details["summary_id"]
-        await bot_db.store_summary_id(summary_id=summary_id, discord_guild_id=guild.id)
-        summary = retrieve_summary(summary_id=summary_id, api_key=token)
-        await user.send(f"**Your summary:**")
-        for utterance in summary.summary[summary_size]["structured_summary"]:
-            await user.send(f"```{utterance.summary}```")
-
-        if summarized_chat is not None:
-            await user.send("**Chats used for the summary:**")
-            # Send the summarized chat in chunks of 2000 characters
-            joined_chat: str = ""
-            for chat in summarized_chat:
-                if len(joined_chat) + len(chat) > 2000:
-                    await user.send(f"```{joined_chat}```")
-                    joined_chat = ""
-                joined_chat += f"\n{chat}"
-            await user.send(f"```{joined_chat}```")
-
-        include_chat = True if summarized_chat is not None else False
-        time_started = datetime.strptime(summary.time_started, "%Y-%m-%dT%H:%M:%S.%fZ")
-        time_completed = datetime.strptime(summary.time_completed, "%Y-%m-%dT%H:%M:%S.%fZ")
-        response_time = (time_completed - time_started).total_seconds()
-        self.usage_tracking.log_metrics(
-            user=user.name,
-            guild_name=guild.name,
-            summary_size=summary_size,
-            timeframe=timeframe,
-            language=language,
-            include_chat=include_chat,
-            time_started=time_started,
-            time_completed=time_completed,
-            response_time=response_time,
-        )
-        
-        # Delete job and users data after summary is sent
-        await self.delete_job_after_summary(job_name=job_name, token=token)
+            older_than = datetime.utcnow() - timedelta(days=self.summary_retention_days)
+            try:
+                deleted = await bot_db.prune_summaries(older_than=older_than)
+                if deleted:
+                    logger.info("Pruned %d archived summaries older than %s.", deleted, older_than)
+            except Exception as e:
+                logger.warning("Error while pruning the summary archive: %s", e)
+            await asyncio.sleep(SUMMARY_PRUNING_INTERVAL)
 
-    
-    async def delete_job_after_summary(self, job_name: str, token: str) -> None:
-        """Delete job after summary is complete."""
-        job = retrieve_job(job_name=job_name, api_key=token)
-        if job.job_status == "SummaryComplete":
-            delete_job(job_name=job_name, api_key=token)
 
+    async def revalidate_credentials(self) -> None:
+        """Periodically check the stored credentials and log out the guilds whose token was revoked."""
+        while True:
+            await asyncio.sleep(CREDENTIALS_REVALIDATION_INTERVAL)
+            try:
+                credentials = await bot_db.get_authenticated_credentials()
+            except Exception as e:
+                logger.warning("Could not load the credentials to revalidate: %s", e)
+                continue
+
+            rejected = []
+            for credentials_id, discord_guild_id, email, token in credentials:
+                try:
+                    valid = await credential_validator.validate(email, token, use_cache=False)
+                except Exception as e:
+                    logger.warning("Could not revalidate the credentials of guild %s: %s", discord_guild_id, e)
+                    continue
+                if valid:
+                    self.credential_failures.pop(credentials_id, None)
+                else:
+                    rejected.append((credentials_id, discord_guild_id))
 
-    async def setup_hook(self) -> None:
-        """Setup Hook."""
+            if len(credentials) > 1 and len(rejected) == len(credentials):
+                # Every token failing at once points to a Wordcab outage rather than revocations
+                logger.warning("All %d credentials failed revalidation, skipping revocations.", len(credentials))
+                continue
+
+            current_ids = {credentials_id for credentials_id, *_ in credentials}
+            self.credential_failures = {
+                key: count for key, count in self.credential_failures.items() if key in current_ids
+            }
+            for credentials_id, discord_guild_id in rejected:
+                failures = self.credential_failures.get(credentials_id, 0) + 1
+                self.credential_failures[credentials_id] = failures
+                if failures < CREDENTIALS_REVOCATION_FAILURES:
+                    continue
+                try:
+                    if await bot_db.revoke_credentials(credentials_id):
+                        logger.info(
+                            "Guild %s logged out from Wordcab: its token failed %d revalidations in a row.",
+                            discord_guild_id,
+                            failures,
+                        )
+                    self.credential_failures.pop(credentials_id, None)
+                except Exception as e:
+                    logger.warning("Could not log out guild %s: %s", discord_guild_id, e)
+
+
+    def schedule_delivery(self, delivery: Coroutine) -> asyncio.Task:
+        """Run a summary delivery in the background, tracked so that it's finished before shutdown."""
+        task = self.loop.create_task(delivery)
+        self.delivery_tasks.add(task)
+        task.add_done_callback(self.delivery_tasks.discard)
+        return task
+
+
+    async def close(self) -> None:
+        """Close the client and stop the background tasks."""
+        self.watchdog.stop()
+        tasks = [
+            task
+            for task in (self.pruning_task, self.revalidation_task, self.sweeper_task, *self.delivery_tasks)
+            if task is not None
+        ]
+        for task in tasks:
+            task.cancel()
+        # Let the cancelled tasks run their cleanup, e.g. releasing their job, while the database is connected
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await super().close()
+        await bot_db.disconnect()
+
+
+    async def prepare(self) -> None:
+        """Connect the database, start the background tasks and register the commands."""
+        self.watchdog.start(self)
+        bot_db.connect()
         await bot_db.init_db_and_tables()
+        self.pruning_task = self.loop.create_task(self.prune_summary_archive())
+        self.revalidation_task = self.loop.create_task(self.revalidate_credentials())
+        self.sweeper_task = self.loop.create_task(self.job_sweeper.run())
 
         self.tree.add_command(login)
         self.tree.add_command(logout)
         self.tree.add_command(summarize)
+        self.tree.add_command(summarize_channels)
+        self.tree.add_command(tldr_history)
+
+
+    async def setup_hook(self) -> None:
+        """Setup Hook."""
+        await self.prepare()
         await self.tree.sync()
 
         if self.testing_guild_id is not None:
@@ -175,35 +308,42 @@ class WordcabBot(discord.Client):
                 self.tree.copy_global_to(guild=testing_guild)
                 await self.tree.sync(guild=testing_guild)
             except discord.errors.Forbidden:
-                print("Bot is not in the testing guild.")
+                logger.warning("Bot is not in the testing guild.")
 
 
 async def main():
     """Main function."""
-    logger = logging.getLogger("discord")
-    logger.setLevel(logging.INFO)
-
-    handler = logging.handlers.RotatingFileHandler(
-        filename=f"{os.getenv('DATABASE_VOLUME')}/discord.log",
-        encoding="utf-8",
-        maxBytes=32 * 1024 * 1024,  #32 MiB
-        backupCount=5,  # Rotate through 5 files
+    load_dotenv()
+
+    logger_names = ["discord"]
+    if os.getenv("DATABASE_ECHO", "false").lower() == "true":
+        logger_names.append("sqlalchemy.engine")
+
+    log_level = parse_log_level(os.getenv("LOG_LEVEL"))
+    sample_rates, invalid_sample_rates = parse_sample_rates(os.getenv("LOG_SAMPLING"))
+    listener = setup_logging(
+        log_file=f"{os.getenv('DATABASE_VOLUME')}/discord.log",
+        level=log_level if log_level is not None else logging.INFO,
+        json_format=os.getenv("LOG_FORMAT", "text").lower() == "json",
+        sample_rates=sample_rates,
+        logger_names=logger_names,
     )
-    date_format = "%Y-%m-%d %H:%M:%S"
-    formatter = logging.Formatter("[{asctime}] [{levelname:<8}] {name}: {message}", date_format, style="{")
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    if log_level is None:
+        logger.warning("Invalid LOG_LEVEL %r, falling back to INFO.", os.getenv("LOG_LEVEL"))
+    if invalid_sample_rates:
+        logger.warning("Ignoring invalid LOG_SAMPLING entries: %s", ", ".join(invalid_sample_rates))
 
-    # Start async session
-    async with ClientSession() as web_client:
-        async with WordcabBot(
-            commands.when_mentioned,
-            web_client=web_client,
-            testing_guild_id=os.getenv("TESTING_GUILD_ID", None),
-        ) as client:
-            await client.start(os.getenv("DISCORD_TOKEN", ""))
+    try:
+        # Start async session
+        async with ClientSession() as web_client:
+            async with WordcabBot(
+                web_client=web_client,
+                testing_guild_id=os.getenv("TESTING_GUILD_ID", None),
+            ) as client:
+                await client.start(os.getenv("DISCORD_TOKEN", ""))
+    finally:
+        listener.stop()
 
 
 if __name__ == "__main__":
-    load_dotenv()
     asyncio.run(main())
@@ -12,19 +12,79 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import hashlib
 import logging
+import time
+from typing import Dict
 
 import discord
 from discord import app_commands
 
-from wordcab.login import _check_valid_credentials
-
 from .database import bot_db
 
 
 logger = logging.getLogger("discord")
 
 
+CREDENTIALS_CACHE_TTL = 5 * 60  # 5 minutes
+
+
+class CredentialValidator:
+    """Validate Wordcab credentials off the event loop, with a short-lived cache of valid credentials."""
+    def __init__(self, ttl: float = CREDENTIALS_CACHE_TTL):
+        """Initialization."""
+        self.ttl = ttl
+        self._valid_until: Dict[str, float] = {}
+
+
+    async def validate(self, email: str, token: str, use_cache: bool = True) -> bool:
+        """
+        Check that the credentials are valid.
+
+        Parameters
+        ----------
+        email: str
+            The Wordcab account email.
+        token: str
+            The Wordcab API token.
+        use_cache: bool, default=True
+            Whether to trust a recent successful validation of the same credentials.
+
+        Returns
+        -------
+        bool
+            Whether the credentials are valid.
+        """
+        fingerprint = self._fingerprint(email, token)
+        now = time.monotonic()
+        if use_cache and self._valid_until.get(fingerprint, 0.0) > now:
+            return True
+
+        from wordcab.login import _check_valid_credentials
+
+        loop = asyncio.get_running_loop()
+        valid = await loop.run_in_executor(None, _check_valid_credentials, email, token)
+        if valid:
+            self._valid_until[fingerprint] = time.monotonic() + self.ttl
+        else:
+            self._valid_until.pop(fingerprint, None)
+
+        # Drop expired fingerprints so the cache doesn't grow with every login attempt
+        self._valid_until = {key: expiry for key, expiry in self._valid_until.items() if expiry > now}
+
+        return bool(valid)
+
+
+    @staticmethod
+    def _fingerprint(email: str, token: str) -> str:
+        """Fingerprint credentials so the token isn't kept in memory."""
+        return hashlib.sha256(f"{email}:{token}".encode("utf-8")).hexdigest()
+
+
+credential_validator = CredentialValidator()
+
+
 class Login(discord.ui.Modal, title="Log in to Wordcab"):
     """Login modal view for logging in to Wordcab."""
 
@@ -44,22 +104,28 @@ class Login(discord.ui.Modal, title="Log in to Wordcab"):
 
     async def on_submit(self, interaction: discord.Interaction):
         """On submit."""
-        valid = _check_valid_credentials(self.email.value, self.api_token.value)
+        # The validation is a network round trip that can outlast the modal response deadline
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        valid = await credential_validator.validate(self.email.value, self.api_token.value)
         if not valid:
-            await interaction.response.send_message(
+            await interaction.followup.send(
                 "❌ Invalid credentials.",
                 ephemeral=True,
             )
         else:
             guild_id = await bot_db.get_a_guild_id(interaction.guild.id)
             if guild_id is None:
-                await interaction.response.send_message("❌ Guild not found.", ephemeral=True)
+                await interaction.followup.send("❌ Guild not found.", ephemeral=True)
+                return
             await bot_db.authenticate_a_guild(guild_id=guild_id, email=self.email.value, token=self.api_token.value)
-            await interaction.response.send_message(f"✅ Authenticated {self.email.value}!", ephemeral=True)
+            await interaction.followup.send(f"✅ Authenticated {self.email.value}!", ephemeral=True)
 
 
     async def on_error(self, interaction: discord.Interaction, error: Exception):
-        await interaction.response.send_message(f"Error: {error}", ephemeral=True)
+        if interaction.response.is_done():
+            await interaction.followup.send(f"Error: {error}", ephemeral=True)
+        else:
+            await interaction.response.send_message(f"Error: {error}", ephemeral=True)
 
 
 class Logout(discord.ui.View):
@@ -107,7 +173,7 @@ async def logout(interaction: discord.Interaction):
             await interaction.response.send_message("Are you sure you want to log out?", view=view)
             await view.wait()
             if view.value:
-                logger.info(f"Guild {interaction.guild} logged out from Wordcab.")
+                logger.info("Guild %s logged out from Wordcab.", interaction.guild)
             else:
-                logger.info(f"Guild {interaction.guild} cancelled logout from Wordcab.")
+                logger.info("Guild %s cancelled logout from Wordcab.", interaction.guild)
             view.clear_items()
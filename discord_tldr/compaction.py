@@ -0,0 +1,210 @@
+# Copyright 2022 The Wordcab Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+from collections import deque
+from typing import Deque, Iterable, List, Optional, Set, Tuple
+
+
+HASH_BASE = 257
+HASH_MODULUS = (1 << 61) - 1
+SHINGLE_SIZE = 5
+SIMILARITY_THRESHOLD = 0.8
+SIMILARITY_WINDOW = 50
+MIN_DUPLICATE_LENGTH = 12
+
+CUSTOM_EMOJI_REGEX = re.compile(r"<a?:\w+:\d+>")
+NON_WORD_REGEX = re.compile(r"[\W_]+")
+
+
+def compact_transcript(
+    messages: Iterable[Tuple[str, str]],
+    max_chars: Optional[int] = None,
+    shingle_size: int = SHINGLE_SIZE,
+    similarity_threshold: float = SIMILARITY_THRESHOLD,
+    similarity_window: int = SIMILARITY_WINDOW,
+    min_duplicate_length: int = MIN_DUPLICATE_LENGTH,
+) -> Tuple[List[str], int]:
+    """
+    Compact a transcript before sending it to Wordcab.
+
+    Messages that are empty once cleaned are dropped, exact and near duplicates are collapsed
+    and consecutive messages from the same author are merged into a single line.
+
+    Short messages like "yes" or "ok" are often answers, so they are only collapsed when they
+    repeat the message right before them, e.g. a run of "gm".
+
+    When `max_chars` is given, the messages are consumed lazily and compaction stops as soon as
+    the lines reach the budget, the last line being truncated to fit.
+
+    Parameters
+    ----------
+    messages: Iterable[Tuple[str, str]]
+        The `(author, content)` pairs to compact, in chronological order.
+    max_chars: Optional[int], default=None
+        The maximum total number of characters of the returned lines. Unlimited if not provided.
+    shingle_size: int, default=5
+        The size of the character shingles used to detect near duplicates.
+    similarity_threshold: float, default=0.8
+        The Jaccard similarity above which a message is considered a near duplicate.
+    similarity_window: int, default=50
+        The number of previously kept messages a message is compared against.
+    min_duplicate_length: int, default=12
+        The normalized length below which a message is only collapsed if it repeats the previous one.
+
+    Returns
+    -------
+    Tuple[List[str], int]
+        The compacted transcript lines and the number of characters saved on the consumed messages.
+    """
+    original_chars = 0
+    total_chars = 0
+
+    kept: List[Tuple[str, str]] = []
+    recent_fingerprints: Deque[int] = deque(maxlen=similarity_window)
+    recent_shingles: Deque[Set[int]] = deque(maxlen=similarity_window)
+    last_fingerprint: Optional[int] = None
+    for author, content in messages:
+        if max_chars is not None and total_chars >= max_chars:
+            break
+        original_chars += len(f"{author}: {content}")
+
+        normalized = normalize_message(content)
+        if not normalized:
+            continue
+
+        fingerprint = polynomial_hash(normalized)
+        if fingerprint == last_fingerprint:
+            continue
+
+        if len(normalized) >= min_duplicate_length:
+            if fingerprint in recent_fingerprints:
+                continue
+            shingles = rolling_hashes(normalized, shingle_size)
+            if any(jaccard_similarity(shingles, other) >= similarity_threshold for other in recent_shingles):
+                continue
+            recent_fingerprints.append(fingerprint)
+            recent_shingles.append(shingles)
+
+        last_fingerprint = fingerprint
+
+        content = " ".join(content.split())
+        merged = bool(kept) and kept[-1][0] == author
+        # Merging adds a space, a new line adds the `author: ` prefix
+        overhead = 1 if merged else len(author) + 2
+        if max_chars is not None and total_chars + overhead + len(content) > max_chars:
+            content = content[: max(max_chars - total_chars - overhead, 0)]
+            if not content:
+                break
+        total_chars += overhead + len(content)
+
+        if merged:
+            kept[-1] = (author, f"{kept[-1][1]} {content}")
+        else:
+            kept.append((author, content))
+
+    lines = [f"{author}: {content}" for author, content in kept]
+    chars_saved = original_chars - sum(len(line) for line in lines)
+
+    return lines, chars_saved
+
+
+def normalize_message(text: str) -> str:
+    """
+    Normalize a message for duplicate detection.
+
+    Parameters
+    ----------
+    text: str
+        The message content.
+
+    Returns
+    -------
+    str
+        The lowercased message without custom emojis, punctuation and extra spaces.
+        An empty string means the message carries no words.
+    """
+    text = CUSTOM_EMOJI_REGEX.sub(" ", text.lower())
+    return NON_WORD_REGEX.sub(" ", text).strip()
+
+
+def polynomial_hash(text: str) -> int:
+    """
+    Compute the polynomial hash of a string.
+
+    Parameters
+    ----------
+    text: str
+        The string to hash.
+
+    Returns
+    -------
+    int
+        The hash of the string.
+    """
+    value = 0
+    for char in text:
+        value = (value * HASH_BASE + ord(char)) % HASH_MODULUS
+    return value
+
+
+def rolling_hashes(text: str, size: int) -> Set[int]:
+    """
+    Compute the hashes of all the character shingles of a string with a Rabin-Karp rolling hash.
+
+    Parameters
+    ----------
+    text: str
+        The string to hash.
+    size: int
+        The size of the shingles.
+
+    Returns
+    -------
+    Set[int]
+        The set of shingle hashes. Strings shorter than `size` are hashed as a single shingle.
+    """
+    if len(text) <= size:
+        return {polynomial_hash(text)}
+
+    leading_power = pow(HASH_BASE, size - 1, HASH_MODULUS)
+    value = polynomial_hash(text[:size])
+    hashes = {value}
+    for i in range(size, len(text)):
+        value = (value - ord(text[i - size]) * leading_power) % HASH_MODULUS
+        value = (value * HASH_BASE + ord(text[i])) % HASH_MODULUS
+        hashes.add(value)
+
+    return hashes
+
+
+def jaccard_similarity(first: Set[int], second: Set[int]) -> float:
+    """
+    Compute the Jaccard similarity between two sets of hashes.
+
+    Parameters
+    ----------
+    first: Set[int]
+        The first set.
+    second: Set[int]
+        The second set.
+
+    Returns
+    -------
+    float
+        The Jaccard similarity, between 0 and 1.
+    """
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
@@ -12,36 +12,63 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import logging
 import os
-from dotenv import load_dotenv
+from datetime import datetime
+from typing import List, Optional, Tuple
 
+from sqlalchemy import delete, func, inspect, text
 from sqlalchemy.exc import NoResultFound
-from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 
 from sqlmodel import SQLModel, select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from .classes import Credentials, Guilds, Summaries
+from .classes import Credentials, Guilds, Jobs, Summaries
 
 
-load_dotenv()
-DATABASE_VOLUME = os.getenv("DATABASE_VOLUME")
+logger = logging.getLogger("discord")
 
 
 class BotDB():
     """Bot Database."""
     def __init__(self):
-        """Initialization."""
-        self.sqlite_file_name = f"{DATABASE_VOLUME}/bot-database.db"
+        """Initialization. The engine is only created by `connect()`."""
+        self.sqlite_file_name: Optional[str] = None
+        self.sqlite_url: Optional[str] = None
+        self._engine: Optional[AsyncEngine] = None
+
+
+    def connect(self, database_volume: Optional[str] = None):
+        """Create the database engine, in `database_volume` or the `DATABASE_VOLUME` directory."""
+        database_volume = database_volume or os.getenv("DATABASE_VOLUME")
+        self.sqlite_file_name = f"{database_volume}/bot-database.db"
         self.sqlite_url = f"sqlite+aiosqlite:///{self.sqlite_file_name}"
 
-        self.engine = create_async_engine(self.sqlite_url, echo=True)
+        self._engine = create_async_engine(self.sqlite_url)
+
+
+    async def disconnect(self):
+        """Dispose of the database engine."""
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
+
+
+    @property
+    def engine(self) -> AsyncEngine:
+        """The database engine."""
+        if self._engine is None:
+            raise RuntimeError("The database is not connected. Call `bot_db.connect()` first.")
+        return self._engine
 
 
     async def init_db_and_tables(self):
         """Initialize the database and the tables."""
         async with self.engine.begin() as session:
             await session.run_sync(SQLModel.metadata.create_all)
+            await session.run_sync(_migrate_summaries_table)
 
 
     async def add_a_guild(self, discord_guild_id: int, guild_owner_id: int):
@@ -50,7 +77,7 @@ class BotDB():
             guild = await session.exec(select(Guilds).where(Guilds.discord_guild_id == discord_guild_id))
             try:
                 guild = guild.one()
-                print("Guild already exists.")
+                logger.debug("Guild %s already exists.", discord_guild_id)
             except NoResultFound:
                 guild = Guilds(discord_guild_id=discord_guild_id, guild_owner_id=guild_owner_id)
                 session.add(guild)
@@ -64,6 +91,8 @@ class BotDB():
             guild = await session.exec(select(Guilds).where(Guilds.id == guild_id))
             guild = guild.one()
             guild.logged_in = True
+            # Replace the previous credentials, only the latest token is kept
+            await session.execute(delete(Credentials).where(Credentials.guild_id == guild.id))
             credentials = Credentials(email=email, token=token, guild_id=guild.id)
             session.add(credentials)
             await session.commit()
@@ -86,7 +115,8 @@ class BotDB():
             guild = guild.one()
             guild.logged_in = False
             credentials = await session.exec(select(Credentials).where(Credentials.guild_id == guild.id))
-            session.delete(credentials)
+            for credential in credentials.all():
+                await session.delete(credential)
             await session.commit()
             await session.refresh(guild)
 
@@ -104,8 +134,40 @@ class BotDB():
         async with AsyncSession(self.engine) as session:
             guild = await session.exec(select(Guilds).where(Guilds.discord_guild_id == discord_guild_id))
             guild = guild.one()
-            credentials = await session.get(Credentials, guild.id)
-            return credentials.token
+            credentials = await session.exec(
+                select(Credentials).where(Credentials.id.in_(_current_credentials_ids(guild.id)))
+            )
+            return credentials.one().token
+
+
+    async def get_authenticated_credentials(self) -> List[Tuple[int, int, str, str]]:
+        """Get the credentials id, discord guild id, email and current token of every authenticated guild."""
+        async with AsyncSession(self.engine) as session:
+            credentials = await session.exec(
+                select(Credentials.id, Guilds.discord_guild_id, Credentials.email, Credentials.token)
+                .join(Credentials, Credentials.guild_id == Guilds.id)
+                .where(Guilds.logged_in == True)  # noqa: E712
+                .where(Credentials.id.in_(_current_credentials_ids()))
+            )
+            return credentials.all()
+
+
+    async def revoke_credentials(self, credentials_id: int) -> bool:
+        """
+        Delete revoked credentials and log their guild out.
+
+        Nothing happens if the credentials were replaced in the meantime. Return whether the guild was logged out.
+        """
+        async with AsyncSession(self.engine) as session:
+            credentials = await session.get(Credentials, credentials_id)
+            if credentials is None:
+                return False
+            guild = await session.exec(select(Guilds).where(Guilds.id == credentials.guild_id))
+            guild = guild.one()
+            guild.logged_in = False
+            await session.execute(delete(Credentials).where(Credentials.guild_id == guild.id))
+            await session.commit()
+            return True
 
 
     async def remove_a_guild(self, discord_guild_id: int):
@@ -117,15 +179,132 @@ class BotDB():
             await session.commit()
 
     
-    async def store_summary_id(self, discord_guild_id: str, summary_id: str):
-        """Store a summary id."""
+    async def archive_summary(
+        self,
+        discord_guild_id: int,
+        summary_id: str,
+        channel_id: Optional[int],
+        channel_name: str,
+        channel_ids: Optional[List[int]],
+        summary_text: str,
+        summary_size: str,
+        language: str,
+        timeframe: str,
+    ):
+        """Archive a summary."""
         async with AsyncSession(self.engine) as session:
             guild = await session.exec(select(Guilds).where(Guilds.discord_guild_id == discord_guild_id))
             guild = guild.one()
-            summary = Summaries(summary_id=summary_id, guild_id=guild.id)
+            summary = Summaries(
+                summary_id=summary_id,
+                guild_id=guild.id,
+                channel_id=channel_id,
+                channel_name=channel_name,
+                channel_ids=",".join(str(channel_id) for channel_id in channel_ids) if channel_ids else None,
+                summary_text=summary_text,
+                summary_size=summary_size,
+                language=language,
+                timeframe=timeframe,
+            )
             session.add(summary)
             await session.commit()
             await session.refresh(summary)
 
 
+    async def get_recent_summaries(
+        self, discord_guild_id: int, channel_id: Optional[int] = None, limit: int = 5, offset: int = 0
+    ) -> List[Summaries]:
+        """Get the most recent summaries of a guild, optionally restricted to a channel."""
+        async with AsyncSession(self.engine) as session:
+            guild = await session.exec(select(Guilds).where(Guilds.discord_guild_id == discord_guild_id))
+            guild = guild.one()
+            statement = select(Summaries).where(Summaries.guild_id == guild.id)
+            if channel_id is not None:
+                statement = statement.where(Summaries.channel_id == channel_id)
+            summaries = await session.exec(statement.order_by(Summaries.created_at.desc()).offset(offset).limit(limit))
+            return summaries.all()
+
+
+    async def prune_summaries(self, older_than: datetime, batch_size: int = 500) -> int:
+        """Delete the summaries created before a date, in batches. Return the number of deleted rows."""
+        deleted = 0
+        while True:
+            async with AsyncSession(self.engine) as session:
+                expired_ids = select(Summaries.id).where(Summaries.created_at < older_than).limit(batch_size)
+                result = await session.execute(delete(Summaries).where(Summaries.id.in_(expired_ids)))
+                await session.commit()
+            deleted += result.rowcount
+            if result.rowcount < batch_size:
+                return deleted
+            # Let other coroutines use the database between two batches
+            await asyncio.sleep(0)
+
+
+    async def track_job(self, discord_guild_id: int, job_name: str):
+        """Track a launched job until it is deleted from Wordcab."""
+        async with AsyncSession(self.engine) as session:
+            guild = await session.exec(select(Guilds).where(Guilds.discord_guild_id == discord_guild_id))
+            guild = guild.one()
+            session.add(Jobs(job_name=job_name, guild_id=guild.id))
+            await session.commit()
+
+
+    async def release_job(self, job_name: str):
+        """Mark a job as no longer needed by its delivery task, so it can be deleted from Wordcab."""
+        async with AsyncSession(self.engine) as session:
+            job = await session.exec(select(Jobs).where(Jobs.job_name == job_name))
+            job = job.first()
+            if job is not None:
+                job.released = True
+                session.add(job)
+                await session.commit()
+
+
+    async def get_tracked_jobs(self) -> List[Tuple[str, bool, datetime, Optional[str]]]:
+        """Get the name, release state, creation time and guild token of every tracked job."""
+        async with AsyncSession(self.engine) as session:
+            jobs = await session.exec(
+                select(Jobs.job_name, Jobs.released, Jobs.created_at, Credentials.token)
+                .join(
+                    Credentials,
+                    (Credentials.guild_id == Jobs.guild_id) & Credentials.id.in_(_current_credentials_ids()),
+                    isouter=True,
+                )
+                .order_by(Jobs.created_at)
+            )
+            return jobs.all()
+
+
+    async def forget_jobs(self, job_names: List[str]):
+        """Stop tracking jobs."""
+        if not job_names:
+            return
+        async with AsyncSession(self.engine) as session:
+            await session.execute(delete(Jobs).where(Jobs.job_name.in_(job_names)))
+            await session.commit()
+
+
+def _current_credentials_ids(guild_id: Optional[int] = None):
+    """Select the id of the latest credentials of each guild, older rows may remain from previous versions."""
+    statement = select(func.max(Credentials.id)).group_by(Credentials.guild_id)
+    if guild_id is not None:
+        statement = statement.where(Credentials.guild_id == guild_id)
+    return statement
+
+
+def _migrate_summaries_table(connection) -> None:
+    """Add the archive columns and indexes to a summaries table created by an older version."""
+    table = Summaries.__table__
+    existing_columns = {column["name"] for column in inspect(connection).get_columns(table.name)}
+    for column in table.columns:
+        if column.name not in existing_columns:
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+    if "created_at" not in existing_columns:
+        connection.execute(text(f"UPDATE {table.name} SET created_at = CURRENT_TIMESTAMP"))
+
+    for index in table.indexes:
+        index.create(connection, checkfirst=True)
+
+
 bot_db = BotDB()
@@ -12,8 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from datetime import datetime
 from typing import Optional
 
+from sqlalchemy import Column, Index, Text
 from sqlmodel import Field, SQLModel
 
 
@@ -40,6 +42,27 @@ class Members(SQLModel, table=True):
 
 class Summaries(SQLModel, table=True):
     """Summaries table."""
+    __table_args__ = (
+        Index("ix_summaries_guild_id_created_at", "guild_id", "created_at"),
+        Index("ix_summaries_guild_id_channel_id_created_at", "guild_id", "channel_id", "created_at"),
+    )
+
     id: int = Field(primary_key=True)
     guild_id: int = Field(foreign_key="guilds.id")
-    summary_id: str
\ No newline at end of file
+    summary_id: str
+    channel_id: Optional[int] = None
+    channel_name: Optional[str] = None
+    channel_ids: Optional[str] = Field(default=None, sa_column=Column(Text))
+    summary_text: Optional[str] = Field(default=None, sa_column=Column(Text))
+    summary_size: Optional[str] = None
+    language: Optional[str] = None
+    timeframe: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+class Jobs(SQLModel, table=True):
+    """Jobs table."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    guild_id: int = Field(foreign_key="guilds.id", index=True)
+    job_name: str = Field(unique=True, index=True)
+    released: bool = Field(default=False)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
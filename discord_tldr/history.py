@@ -0,0 +1,184 @@
+# Copyright 2022 The Wordcab Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from typing import List, Optional
+
+import discord
+from discord import app_commands
+
+from .database import bot_db
+from .database.classes import Summaries
+from .summarize import SUMMARY_SIZES, HistoryChannel, can_read_history
+
+
+logger = logging.getLogger("discord")
+
+
+MAX_HISTORY_COUNT = 10
+MAX_MESSAGE_CHARS = 2000
+HISTORY_PAGE_SIZE = 25
+MAX_HISTORY_PAGES = 8
+SUMMARY_SIZE_NAMES = {str(value): name for name, value in SUMMARY_SIZES.items()}
+
+
+@app_commands.command(name="tldr-history", description="Show the latest summaries of this server.")
+async def tldr_history(
+    interaction: discord.Interaction,
+    channel: Optional[HistoryChannel] = None,
+    count: Optional[app_commands.Range[int, 1, MAX_HISTORY_COUNT]] = 3,
+) -> None:
+    """
+    Command that show the latest archived summaries without calling Wordcab.
+
+    Only the summaries of channels where the user can read the message history are shown.
+
+    Parameters
+    ----------
+    interaction: discord.Interaction
+        A Discord Interaction object.
+    channel: HistoryChannel, default=None
+        Only show the summaries of this channel or thread.
+    count: int, default=3
+        The number of summaries to show.
+    """
+    try:
+        summaries: List[Summaries] = []
+        for page in range(MAX_HISTORY_PAGES):
+            candidates = await bot_db.get_recent_summaries(
+                interaction.guild.id,
+                channel_id=channel.id if channel is not None else None,
+                limit=HISTORY_PAGE_SIZE,
+                offset=page * HISTORY_PAGE_SIZE,
+            )
+            summaries.extend(s for s in candidates if can_read_summary(interaction, s))
+            if len(summaries) >= count or len(candidates) < HISTORY_PAGE_SIZE:
+                break
+        summaries = summaries[:count]
+        if not summaries:
+            await interaction.response.send_message("No archived summaries to show.", ephemeral=True)
+            return
+
+        chunks: List[str] = []
+        for summary in summaries:
+            size = SUMMARY_SIZE_NAMES.get(summary.summary_size, summary.summary_size)
+            header = (
+                f"**#{summary.channel_name}** - {summary.created_at:%Y-%m-%d %H:%M} UTC - "
+                f"{size} summary of the last {summary.timeframe} ({summary.language})"
+            )
+            chunks.append(header)
+            chunks.extend(split_text(summary.summary_text or "", MAX_MESSAGE_CHARS - 6))
+
+        messages = pack_chunks(chunks, MAX_MESSAGE_CHARS)
+        await interaction.response.send_message(messages[0], ephemeral=True)
+        for message in messages[1:]:
+            await interaction.followup.send(message, ephemeral=True)
+    except Exception as e:
+        logger.warning("Error while responding to interaction: %s", e)
+        await interaction.response.send_message(f"Error: {e}", ephemeral=True)
+
+
+def can_read_summary(interaction: discord.Interaction, summary: Summaries) -> bool:
+    """
+    Check that the user can read the history of every channel a summary was made from.
+
+    Parameters
+    ----------
+    interaction: discord.Interaction
+        A Discord Interaction object.
+    summary: Summaries
+        The archived summary.
+
+    Returns
+    -------
+    bool
+        Whether the summary can be shown to the user. Summaries without recorded channels are hidden.
+    """
+    if summary.channel_ids:
+        channel_ids = [int(channel_id) for channel_id in summary.channel_ids.split(",")]
+    elif summary.channel_id is not None:
+        channel_ids = [summary.channel_id]
+    else:
+        return False
+
+    for channel_id in channel_ids:
+        channel = interaction.guild.get_channel_or_thread(channel_id)
+        if channel is None or not can_read_history(interaction.user, channel):
+            return False
+
+    return True
+
+
+def split_text(text: str, max_chars: int) -> List[str]:
+    """
+    Split a summary into code blocks of at most `max_chars` characters of content.
+
+    Parameters
+    ----------
+    text: str
+        The summary text.
+    max_chars: int
+        The maximum number of characters in a block.
+
+    Returns
+    -------
+    List[str]
+        The code blocks.
+    """
+    blocks: List[str] = []
+    current = ""
+    for line in text.split("\n"):
+        while len(line) > max_chars:
+            if current:
+                blocks.append(current)
+                current = ""
+            blocks.append(line[:max_chars])
+            line = line[max_chars:]
+        if current and len(current) + len(line) + 1 > max_chars:
+            blocks.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        blocks.append(current)
+
+    return [f"```{block}```" for block in blocks]
+
+
+def pack_chunks(chunks: List[str], max_chars: int) -> List[str]:
+    """
+    Pack chunks into as few messages as possible.
+
+    Parameters
+    ----------
+    chunks: List[str]
+        The chunks to pack, each shorter than `max_chars`.
+    max_chars: int
+        The maximum number of characters in a message.
+
+    Returns
+    -------
+    List[str]
+        The messages.
+    """
+    messages: List[str] = []
+    current = ""
+    for chunk in chunks:
+        if current and len(current) + len(chunk) + 1 > max_chars:
+            messages.append(current)
+            current = ""
+        current = f"{current}\n{chunk}" if current else chunk
+    if current:
+        messages.append(current)
+
+    return messages
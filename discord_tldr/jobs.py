@@ -0,0 +1,145 @@
+# Copyright 2022 The Wordcab Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+from .database import bot_db
+
+
+logger = logging.getLogger("discord.jobs")
+
+
+DELETED_STATUS = "Deleted"
+ERROR_STATUS = "Error"
+
+
+class JobSweeper:
+    """Delete the released, failed or expired Wordcab jobs launched by the bot."""
+    def __init__(
+        self,
+        interval: float = 10 * 60,
+        expiration: timedelta = timedelta(hours=24),
+        max_concurrency: int = 4,
+        max_retries: int = 3,
+        retry_delay: float = 2.0,
+    ):
+        """
+        Initialization.
+
+        Parameters
+        ----------
+        interval: float, default=600
+            The time in seconds between two sweeps.
+        expiration: timedelta, default=24 hours
+            The age after which a job is deleted even if its delivery task never released it.
+        max_concurrency: int, default=4
+            The maximum number of Wordcab requests made at the same time.
+        max_retries: int, default=3
+            The number of attempts for each Wordcab request.
+        retry_delay: float, default=2.0
+            The delay in seconds before the first retry, doubled after each attempt.
+        """
+        self.interval = interval
+        self.expiration = expiration
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+
+    async def run(self) -> None:
+        """Sweep the tracked jobs periodically."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.warning("Error while sweeping Wordcab jobs: %s", e)
+
+
+    async def sweep(self) -> Counter:
+        """
+        Delete the tracked jobs that are released by their delivery task, failed or expired.
+
+        Returns
+        -------
+        Counter
+            The number of jobs by outcome: `deleted`, `already_deleted`, `abandoned`, `pending` and `failed`.
+        """
+        from wordcab import delete_job, retrieve_job
+
+        jobs: Dict[str, Tuple[bool, datetime, Optional[str]]] = {
+            job_name: (released, created_at, token)
+            for job_name, released, created_at, token in await bot_db.get_tracked_jobs()
+        }
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        expired_before = datetime.utcnow() - self.expiration
+
+        async def sweep_job(job_name: str, released: bool, created_at: datetime, token: Optional[str]) -> str:
+            """Delete a single job if it can be deleted and return the outcome."""
+            expired = created_at < expired_before
+            if token is None:
+                # The guild logged out, there is no way to delete the job anymore
+                return "abandoned" if expired else "pending"
+
+            async with semaphore:
+                try:
+                    job = await self._call_with_retries(retrieve_job, job_name=job_name, api_key=token)
+                    if job.job_status == DELETED_STATUS:
+                        return "already_deleted"
+                    if released or expired or job.job_status == ERROR_STATUS:
+                        await self._call_with_retries(delete_job, job_name=job_name, api_key=token)
+                        return "deleted"
+                except Exception as e:
+                    logger.warning("Could not sweep Wordcab job %s: %s", job_name, e)
+                    return "abandoned" if expired else "failed"
+
+            return "pending"
+
+        outcomes = await asyncio.gather(*(sweep_job(name, *job) for name, job in jobs.items()))
+        report = Counter(outcomes)
+
+        await bot_db.forget_jobs(
+            [name for name, outcome in zip(jobs, outcomes) if outcome in ("deleted", "already_deleted", "abandoned")]
+        )
+        if jobs:
+            logger.info(
+                "Swept %d Wordcab jobs: %d deleted, %d already deleted, %d abandoned, %d pending, %d failed.",
+                len(jobs),
+                report["deleted"],
+                report["already_deleted"],
+                report["abandoned"],
+                report["pending"],
+                report["failed"],
+            )
+
+        return report
+
+
+    async def _call_with_retries(self, function: Callable, **kwargs):
+        """Call a blocking Wordcab function in an executor, retrying with an exponential backoff."""
+        loop = asyncio.get_running_loop()
+        delay = self.retry_delay
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                return await loop.run_in_executor(None, lambda: function(**kwargs))
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(delay)
+                delay *= 2
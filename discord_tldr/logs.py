@@ -0,0 +1,255 @@
+# Copyright 2022 The Wordcab Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import logging.handlers
+import queue
+import random
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+TEXT_FORMAT = "[{asctime}] [{levelname:<8}] {name}: {message}"
+MAX_LOG_BYTES = 32 * 1024 * 1024  # 32 MiB
+LOG_BACKUP_COUNT = 5  # Rotate through 5 files
+QUEUE_SIZE = 10000
+WARNING_PUT_TIMEOUT = 0.5  # Seconds a WARNING record may wait for room in a full queue
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Format a record."""
+        payload = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            payload["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of the records emitted by some loggers.
+
+    Records of level WARNING and above are never dropped.
+    """
+
+    def __init__(self, sample_rates: Dict[str, float]):
+        """
+        Initialization.
+
+        Parameters
+        ----------
+        sample_rates: Dict[str, float]
+            The fraction of records to keep, between 0 and 1, by logger name. A rate
+            applies to the logger and all its children.
+        """
+        super().__init__()
+        self.sample_rates = sample_rates
+
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Decide whether the record should be kept."""
+        if record.levelno >= logging.WARNING or not self.sample_rates:
+            return True
+
+        rate = self._get_rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+    def _get_rate(self, name: str) -> float:
+        """Get the sampling rate of the closest configured parent logger."""
+        while name:
+            if name in self.sample_rates:
+                return self.sample_rates[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that bounds the time the event loop can spend on a full queue.
+
+    Records below WARNING are dropped right away when the queue is full. Records of level WARNING
+    and above wait up to `WARNING_PUT_TIMEOUT` seconds for room, and are only dropped if the
+    listener is stalled. Dropped records are counted and reported once the queue has room again.
+
+    Records are formatted by the stdlib `prepare` when they are enqueued, so the listener thread
+    never touches the live logging arguments. Records dropped by a filter are never formatted.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        """Initialization."""
+        super().__init__(log_queue)
+        self.dropped_records = 0
+        self._unreported_drops = 0
+        self._stalled = False
+
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """Enqueue a record, dropping and counting it if the listener can't keep up."""
+        try:
+            if record.levelno >= logging.WARNING and not self._stalled:
+                self.queue.put(record, timeout=WARNING_PUT_TIMEOUT)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            # Once a WARNING timed out, don't wait again until the listener has caught up
+            self._stalled = record.levelno >= logging.WARNING or self._stalled
+            self.dropped_records += 1
+            self._unreported_drops += 1
+            return
+        self._stalled = False
+
+        if self._unreported_drops:
+            try:
+                self.queue.put_nowait(
+                    logging.makeLogRecord(
+                        {
+                            "name": record.name,
+                            "levelno": logging.WARNING,
+                            "levelname": "WARNING",
+                            "msg": f"Dropped {self._unreported_drops} log records because the log queue was full "
+                            f"({self.dropped_records} since startup).",
+                        }
+                    )
+                )
+                self._unreported_drops = 0
+            except queue.Full:
+                pass
+
+
+def parse_sample_rates(value: Optional[str]) -> Tuple[Dict[str, float], List[str]]:
+    """
+    Parse sampling rates from a string like `sqlalchemy.engine=0.1,discord.gateway=0.5`.
+
+    Parameters
+    ----------
+    value: Optional[str]
+        The string to parse.
+
+    Returns
+    -------
+    Tuple[Dict[str, float], List[str]]
+        The sampling rate by logger name and the malformed entries, which are skipped.
+    """
+    sample_rates: Dict[str, float] = {}
+    invalid_entries: List[str] = []
+    if not value:
+        return sample_rates, invalid_entries
+
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        name, _, rate = item.partition("=")
+        try:
+            if not name.strip():
+                raise ValueError
+            sample_rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            invalid_entries.append(item.strip())
+
+    return sample_rates, invalid_entries
+
+
+def parse_log_level(value: Optional[str], default: int = logging.INFO) -> Optional[int]:
+    """
+    Parse a log level name like `DEBUG` or a numeric level.
+
+    Parameters
+    ----------
+    value: Optional[str]
+        The level to parse.
+    default: int, default=logging.INFO
+        The level to use if `value` is empty.
+
+    Returns
+    -------
+    Optional[int]
+        The numeric level, or None if `value` is not a valid level.
+    """
+    if not value:
+        return default
+    if value.strip().isdigit():
+        return int(value)
+
+    level = logging.getLevelName(value.strip().upper())
+    return level if isinstance(level, int) else None
+
+
+def setup_logging(
+    log_file: str,
+    level: int = logging.INFO,
+    json_format: bool = False,
+    sample_rates: Optional[Dict[str, float]] = None,
+    logger_names: Optional[List[str]] = None,
+) -> logging.handlers.QueueListener:
+    """
+    Route the bot loggers through a queue to a background listener thread.
+
+    Parameters
+    ----------
+    log_file: str
+        The path of the rotating log file.
+    level: int, default=logging.INFO
+        The level of the configured loggers.
+    json_format: bool, default=False
+        Whether to write records as JSON lines instead of plain text.
+    sample_rates: Optional[Dict[str, float]], default=None
+        The fraction of records below WARNING to keep, by logger name.
+    logger_names: Optional[List[str]], default=None
+        The loggers to configure. Defaults to the `discord` logger.
+
+    Returns
+    -------
+    logging.handlers.QueueListener
+        The started listener. Call `stop()` on shutdown to flush the remaining records.
+    """
+    if logger_names is None:
+        logger_names = ["discord"]
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        filename=log_file,
+        encoding="utf-8",
+        maxBytes=MAX_LOG_BYTES,
+        backupCount=LOG_BACKUP_COUNT,
+    )
+    if json_format:
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter(TEXT_FORMAT, DATE_FORMAT, style="{"))
+
+    log_queue: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+    queue_handler = BoundedQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_rates or {}))
+
+    for name in logger_names:
+        logger = logging.getLogger(name)
+        logger.setLevel(level)
+        logger.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+
+    return listener
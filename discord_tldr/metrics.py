@@ -16,7 +16,10 @@ import csv
 import glob
 import os
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
+
+
+LAG_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float("inf")]
 
 
 class UsageTracking:
@@ -116,3 +119,81 @@ class UsageTracking:
     def _update_metrics_file_list(self):
         """Update the list of metrics files."""
         self.metrics_files = glob.glob(f"{self.metrics_folder}/*.csv")
+
+
+class LoopLagTracking:
+    """Event loop lag tracking class."""
+    def __init__(self, data_path: Optional[str] = None):
+        self.data_path = data_path or os.getenv("DATABASE_VOLUME")
+        # Kept out of the usage metrics folder, whose files are all picked up by `UsageTracking`
+        self.metrics_folder = f"{self.data_path}/loop_lag"
+        self.lag_file = f"{self.metrics_folder}/loop_lag.csv"
+
+        if not os.path.exists(self.metrics_folder):
+            os.makedirs(self.metrics_folder)
+
+        if not os.path.exists(self.lag_file):
+            with open(self.lag_file, "w") as csv_file:
+                writer = csv.writer(csv_file)
+                writer.writerow(
+                    [
+                        "time",
+                        "samples",
+                        "p50_ms",
+                        "p95_ms",
+                        "p99_ms",
+                        "max_ms",
+                        "gateway_latency_ms",
+                        "worst_offenders",
+                        *[f"le_{bound}ms" if bound != float("inf") else "le_inf" for bound in LAG_BUCKETS_MS],
+                    ]
+                )
+
+    def log_lag(
+        self,
+        samples: int,
+        p50: float,
+        p95: float,
+        p99: float,
+        max_lag: float,
+        gateway_latency: float,
+        worst_offenders: str,
+        histogram: List[int],
+    ):
+        """
+        Log event loop lag metrics.
+
+        Parameters
+        ----------
+        samples : int
+            The number of lag measurements in the report.
+        p50 : float
+            The upper bound in milliseconds of the median lag.
+        p95 : float
+            The upper bound in milliseconds of the 95th percentile lag.
+        p99 : float
+            The upper bound in milliseconds of the 99th percentile lag.
+        max_lag : float
+            The maximum lag in milliseconds.
+        gateway_latency : float
+            The gateway heartbeat latency in milliseconds.
+        worst_offenders : str
+            The calls that blocked the event loop the most often.
+        histogram : List[int]
+            The number of lag measurements in each bucket of `LAG_BUCKETS_MS`.
+        """
+        with open(self.lag_file, "a") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(
+                [
+                    datetime.now(),
+                    samples,
+                    p50,
+                    p95,
+                    p99,
+                    round(max_lag, 1),
+                    round(gateway_latency, 1),
+                    worst_offenders,
+                    *histogram,
+                ]
+            )
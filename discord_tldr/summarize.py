@@ -12,18 +12,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import heapq
 import logging
 import re
 from datetime import datetime, timedelta
-from pytimeparse import parse
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple, Union
 
 import discord
 from discord import app_commands
 
-from wordcab import start_summary
-from wordcab.core_objects import InMemorySource
-
+from .compaction import compact_transcript
 from .database import bot_db
 
 
@@ -31,6 +30,8 @@ logger = logging.getLogger("discord")
 
 
 MAX_CHARS = 4000
+MAX_CHANNELS = 25
+MAX_CONCURRENT_FETCHES = 5
 SUBSTITUTIONS = {
     "http\S+": "",  # Remove links
     "\\U0001f\S+": "",  # Remove emojis
@@ -45,6 +46,9 @@ SUBSTITUTIONS = {
 }
 SUMMARY_SIZES = {"short": 1, "medium": 3, "long": 5}
 
+HistoryChannel = Union[discord.TextChannel, discord.Thread]
+SummarizableChannel = Union[discord.TextChannel, discord.ForumChannel, discord.CategoryChannel, discord.Thread]
+
 
 @app_commands.command(name="summarize", description="Launch a Wordcab summarization job.")
 @app_commands.rename(list_summarized_chat="include_chat")
@@ -77,9 +81,12 @@ async def summarize(
             "Invalid size. Choose from `short`, `medium`, and `long`.",
             ephemeral=True,
         )
+        return
     if source_lang is None:
         source_lang = "en"
     
+    from pytimeparse import parse
+
     try:
         if not await bot_db.is_guild_authenticated(interaction.guild.id):
             await interaction.response.send_message(
@@ -87,69 +94,366 @@ async def summarize(
                 ephemeral=True,
             )
         else:
+            # Reading the history can take longer than the interaction response deadline
+            await interaction.response.defer(ephemeral=True, thinking=True)
+
             token = await bot_db.get_guild_token(interaction.guild.id)
             date = datetime.now() - timedelta(seconds=parse(timeframe))
-            messages: List = []
-            total_chars = 0
+            raw_messages: List[Tuple[str, str]] = []
             async for msg in interaction.channel.history(after=date):
-                if message_to_include(msg) and total_chars < MAX_CHARS:
-                    messages.append(multiple_regex_replace(SUBSTITUTIONS, f"{msg.author}: {msg.content}"))
-                    total_chars += len(msg.content)
-            
-            if total_chars == 0:
-                await interaction.response.send_message(
-                    "No messages to summarize.",
-                    ephemeral=True,
-                )
-            elif total_chars < 1000:
+                if message_to_include(msg):
+                    raw_messages.append((str(msg.author), multiple_regex_replace(SUBSTITUTIONS, msg.content)))
+
+            await launch_summary(
+                interaction,
+                raw_messages,
+                size,
+                timeframe,
+                list_summarized_chat,
+                source_lang,
+                token,
+                interaction.channel.name,
+                channel_id=interaction.channel.id,
+                channel_ids=[interaction.channel.id],
+            )
+    except Exception as e:
+        logger.warning("Error while responding to interaction: %s", e)
+        await send_response(interaction, f"Error: {e}")
+
+
+@app_commands.command(
+    name="summarize-channels",
+    description="Launch a Wordcab summarization job over several channels, threads or a category.",
+)
+@app_commands.rename(list_summarized_chat="include_chat")
+@app_commands.rename(source_lang="language")
+async def summarize_channels(
+    interaction: discord.Interaction,
+    size: str,
+    timeframe: str,
+    channel: SummarizableChannel,
+    channel_2: Optional[SummarizableChannel] = None,
+    channel_3: Optional[SummarizableChannel] = None,
+    channel_4: Optional[SummarizableChannel] = None,
+    channel_5: Optional[SummarizableChannel] = None,
+    include_threads: Optional[bool] = True,
+    list_summarized_chat: Optional[bool] = False,
+    source_lang: Optional[str] = None,
+) -> None:
+    """
+    Command that allow launching a single Wordcab Summarization job over several channels.
+
+    Parameters
+    ----------
+    interaction: discord.Interaction
+        A Discord Interaction object.
+    size: str,
+        The size of the summary. Choose from `short`, `medium`, or `long`.
+    timeframe: str
+        The timeframe of the messages to summarize. e.g. `1w`, `3d`, `45min`, `2h30min`.
+    channel: SummarizableChannel
+        A text channel, forum, thread or category to summarize.
+    channel_2: SummarizableChannel, default=None
+        Another channel to summarize.
+    channel_3: SummarizableChannel, default=None
+        Another channel to summarize.
+    channel_4: SummarizableChannel, default=None
+        Another channel to summarize.
+    channel_5: SummarizableChannel, default=None
+        Another channel to summarize.
+    include_threads: bool, default=True
+        Whether to include the active threads of the selected channels.
+    list_summarized_chat: bool, default=False
+        Whether to list the summarized chat in the response.
+    source_lang: str, default=None
+        The language of the source text. Choose from `de`, `en`, `es`, `fr`, and `it`. It's `en` by default.
+    """
+    if size not in SUMMARY_SIZES.keys():
+        await interaction.response.send_message(
+            "Invalid size. Choose from `short`, `medium`, and `long`.",
+            ephemeral=True,
+        )
+        return
+    if source_lang is None:
+        source_lang = "en"
+
+    from pytimeparse import parse
+
+    try:
+        if not await bot_db.is_guild_authenticated(interaction.guild.id):
+            await interaction.response.send_message(
+                "This guild is not authenticated. Please run `/wordcab-login` first.",
+                ephemeral=True,
+            )
+        else:
+            selected = [c for c in (channel, channel_2, channel_3, channel_4, channel_5) if c is not None]
+            channels = resolve_channels(interaction.user, selected, include_threads)
+            if not channels:
                 await interaction.response.send_message(
-                    "Not enough messages to summarize.",
+                    "No channels to summarize. You can only summarize channels whose message history you can read.",
                     ephemeral=True,
                 )
-            else:
-                source_object = InMemorySource(obj={"transcript": messages})
-                display_name = f"{interaction.channel.name}_{interaction.guild.name}_{interaction.user.name}"
-                summary_size = SUMMARY_SIZES[size]
-                job = start_summary(
-                    source_object=source_object,
-                    display_name=display_name,
-                    source_lang=source_lang,
-                    summary_type="conversational",
-                    summary_length=summary_size,
-                    tags=[interaction.channel.name, interaction.guild.name, interaction.user.name],
-                    api_key=token,
-                )
-                logger.info(
-                    f"{interaction.user} - {interaction.guild}: summary of size {size} with {total_chars} chars launched."
-                )
-                if total_chars > 4000:
-                    await interaction.response.send_message(
-                        f"Summarization job launched: `{job.job_name}`\n\n"
-                        "You should receive the summary in your DM soon! 👌\n\n"
-                        "⚠️ To avoid summary alteration, the chats used for the summary has been truncated to 4000 characters.",
-                        ephemeral=True
-                    )
-                else:
-                    await interaction.response.send_message(
-                        f"Summarization job launched: `{job.job_name}`\n\nYou should receive the summary in your DM soon! 👌",
-                        ephemeral=True
-                    )
-                summarized_messages = messages if list_summarized_chat else None
-                interaction.client.loop.create_task(
-                    interaction.client.send_summary_as_dm(
-                        interaction.guild,
-                        interaction.user,
-                        str(summary_size),
-                        timeframe,
-                        source_lang,
-                        job.job_name,
-                        token,
-                        summarized_messages,
-                    )
-                )
+                return
+
+            # Fetching several histories can take longer than the interaction response deadline
+            await interaction.response.defer(ephemeral=True, thinking=True)
+
+            token = await bot_db.get_guild_token(interaction.guild.id)
+            date = datetime.now() - timedelta(seconds=parse(timeframe))
+            raw_messages = await fetch_channels_history(channels, after=date)
+
+            label = selected[0].name if len(selected) == 1 else "multi-channel"
+            await launch_summary(
+                interaction,
+                raw_messages,
+                size,
+                timeframe,
+                list_summarized_chat,
+                source_lang,
+                token,
+                label,
+                # Categories, forums and channels expanded with their threads can't be filtered on in the history
+                channel_id=channels[0].id if len(channels) == 1 and channels[0] is selected[0] else None,
+                channel_ids=[c.id for c in channels],
+            )
     except Exception as e:
-        logger.warning(f"Error while responding to interaction: {e}")
-        await interaction.response.send_message(f"Error: {e}", ephemeral=True)
+        logger.warning("Error while responding to interaction: %s", e)
+        await send_response(interaction, f"Error: {e}")
+
+
+async def launch_summary(
+    interaction: discord.Interaction,
+    raw_messages: List[Tuple[str, str]],
+    size: str,
+    timeframe: str,
+    list_summarized_chat: bool,
+    source_lang: str,
+    token: str,
+    label: str,
+    channel_id: Optional[int] = None,
+    channel_ids: Optional[List[int]] = None,
+) -> None:
+    """
+    Compact the messages, launch the Wordcab summarization job and schedule the summary delivery.
+
+    Parameters
+    ----------
+    interaction: discord.Interaction
+        A Discord Interaction object.
+    raw_messages: List[Tuple[str, str]]
+        The cleaned `(author, content)` pairs to summarize, in chronological order.
+    size: str,
+        The size of the summary. Choose from `short`, `medium`, or `long`.
+    timeframe: str
+        The timeframe of the messages to summarize.
+    list_summarized_chat: bool
+        Whether to list the summarized chat in the response.
+    source_lang: str
+        The language of the source text.
+    token: str
+        The Wordcab API token.
+    label: str
+        The name of the summarized channel, used for the job display name and tags.
+    channel_id: Optional[int], default=None
+        The id of the summarized channel, if the summary covers a single channel.
+    channel_ids: Optional[List[int]], default=None
+        The ids of every channel and thread whose messages were summarized.
+    """
+    from wordcab import start_summary
+    from wordcab.core_objects import InMemorySource
+
+    messages, chars_saved = compact_transcript(raw_messages, max_chars=MAX_CHARS)
+    total_chars = sum(len(line) for line in messages)
+
+    if total_chars == 0:
+        await send_response(interaction, "No messages to summarize.")
+    elif total_chars < 1000:
+        await send_response(interaction, "Not enough messages to summarize.")
+    else:
+        source_object = InMemorySource(obj={"transcript": messages})
+        display_name = f"{label}_{interaction.guild.name}_{interaction.user.name}"
+        summary_size = SUMMARY_SIZES[size]
+        job = start_summary(
+            source_object=source_object,
+            display_name=display_name,
+            source_lang=source_lang,
+            summary_type="conversational",
+            summary_length=summary_size,
+            tags=[label, interaction.guild.name, interaction.user.name],
+            api_key=token,
+        )
+        # The job is already running on Wordcab, so failing to track it must not fail the command
+        try:
+            await bot_db.track_job(interaction.guild.id, job.job_name)
+        except Exception as e:
+            logger.warning("Could not track Wordcab job %s: %s", job.job_name, e)
+        logger.info(
+            "%s - %s: summary of size %s with %d chars launched (%d chars saved by compaction).",
+            interaction.user,
+            interaction.guild,
+            size,
+            total_chars,
+            chars_saved,
+        )
+        if total_chars >= MAX_CHARS:
+            await send_response(
+                interaction,
+                f"Summarization job launched: `{job.job_name}`\n\n"
+                "You should receive the summary in your DM soon! 👌\n\n"
+                "⚠️ To avoid summary alteration, the chats used for the summary has been truncated to 4000 characters.",
+            )
+        else:
+            await send_response(
+                interaction,
+                f"Summarization job launched: `{job.job_name}`\n\nYou should receive the summary in your DM soon! 👌",
+            )
+        summarized_messages = messages if list_summarized_chat else None
+        interaction.client.schedule_delivery(
+            interaction.client.send_summary_as_dm(
+                interaction.guild,
+                interaction.user,
+                str(summary_size),
+                timeframe,
+                source_lang,
+                job.job_name,
+                token,
+                summarized_messages,
+                channel_id=channel_id,
+                channel_name=label,
+                channel_ids=channel_ids,
+            )
+        )
+
+
+async def send_response(interaction: discord.Interaction, content: str) -> None:
+    """Send an ephemeral response, or a follow-up if the interaction was already deferred."""
+    if interaction.response.is_done():
+        await interaction.followup.send(content, ephemeral=True)
+    else:
+        await interaction.response.send_message(content, ephemeral=True)
+
+
+def resolve_channels(
+    member: discord.Member,
+    channels: List[SummarizableChannel],
+    include_threads: bool,
+) -> List[HistoryChannel]:
+    """
+    Expand categories and forums into the channels and threads whose history the member can read.
+
+    Parameters
+    ----------
+    member: discord.Member
+        The member who runs the command.
+    channels: List[SummarizableChannel]
+        The channels selected by the user.
+    include_threads: bool
+        Whether to include the active threads of the text channels.
+
+    Returns
+    -------
+    List[HistoryChannel]
+        The deduplicated channels and threads, capped to `MAX_CHANNELS`. Channels and threads
+        the member can't read are left out.
+    """
+    resolved: Dict[int, HistoryChannel] = {}
+    pending = list(channels)
+    while pending and len(resolved) < MAX_CHANNELS:
+        channel = pending.pop(0)
+        if isinstance(channel, discord.CategoryChannel):
+            pending.extend(c for c in channel.channels if isinstance(c, (discord.TextChannel, discord.ForumChannel)))
+        elif isinstance(channel, discord.ForumChannel):
+            pending.extend(channel.threads)
+        elif can_read_history(member, channel):
+            resolved.setdefault(channel.id, channel)
+            if include_threads and isinstance(channel, discord.TextChannel):
+                pending.extend(channel.threads)
+
+    return list(resolved.values())
+
+
+def can_read_history(member: discord.Member, channel: HistoryChannel) -> bool:
+    """
+    Check that a member can read the message history of a channel or thread.
+
+    Parameters
+    ----------
+    member: discord.Member
+        The member to check.
+    channel: HistoryChannel
+        The channel or thread to read.
+
+    Returns
+    -------
+    bool
+        Whether the member can read the history. Private threads are only readable by their
+        members and by the members who can manage threads.
+    """
+    permissions = channel.permissions_for(member)
+    if not permissions.read_message_history:
+        return False
+    if isinstance(channel, discord.Thread) and channel.is_private():
+        return (
+            permissions.manage_threads
+            or channel.owner_id == member.id
+            or any(thread_member.id == member.id for thread_member in channel.members)
+        )
+    return True
+
+
+async def fetch_channels_history(
+    channels: List[HistoryChannel],
+    after: datetime,
+    max_chars: int = MAX_CHARS,
+    max_concurrency: int = MAX_CONCURRENT_FETCHES,
+) -> List[Tuple[str, str]]:
+    """
+    Fetch the history of several channels concurrently and merge it into one channel-labelled transcript.
+
+    Parameters
+    ----------
+    channels: List[HistoryChannel]
+        The channels and threads to read.
+    after: datetime
+        Only the messages sent after this date are fetched.
+    max_chars: int, default=MAX_CHARS
+        The number of characters after which the fetch of a channel stops. The transcript is merged
+        oldest first, so a channel can't contribute more than the summary budget.
+    max_concurrency: int, default=MAX_CONCURRENT_FETCHES
+        The maximum number of histories fetched at the same time.
+
+    Returns
+    -------
+    List[Tuple[str, str]]
+        The cleaned `(author, content)` pairs of all channels, in chronological order. Authors are
+        prefixed with the channel name.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch_history(channel: HistoryChannel) -> List[Tuple[datetime, str, str]]:
+        """Fetch the history of a single channel."""
+        history: List[Tuple[datetime, str, str]] = []
+        total_chars = 0
+        async with semaphore:
+            try:
+                async for msg in channel.history(after=after):
+                    if message_to_include(msg):
+                        author = f"[#{channel.name}] {msg.author}"
+                        content = multiple_regex_replace(SUBSTITUTIONS, msg.content)
+                        history.append((msg.created_at, author, content))
+                        total_chars += len(author) + len(content) + 2
+                        if total_chars >= max_chars:
+                            break
+            except discord.errors.Forbidden:
+                logger.info("Missing access to the history of #%s, skipping it.", channel.name)
+            except discord.errors.HTTPException as e:
+                logger.warning("Could not fetch the history of #%s, skipping it: %s", channel.name, e)
+        return history
+
+    histories = await asyncio.gather(*(fetch_history(channel) for channel in channels))
+    merged = heapq.merge(*histories, key=lambda message: message[0])
+
+    return [(author, content) for _, author, content in merged]
 
 
 def multiple_regex_replace(substitutions: Dict[str, str], text: str) -> str:
@@ -0,0 +1,236 @@
+# Copyright 2022 The Wordcab Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from .metrics import LAG_BUCKETS_MS, LoopLagTracking
+
+
+logger = logging.getLogger("discord.watchdog")
+
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class LoopWatchdog:
+    """Measure the event loop scheduling lag and capture the stack of blocking calls."""
+    def __init__(
+        self,
+        interval: float = 0.1,
+        threshold: float = 0.25,
+        report_interval: float = 60.0,
+        lag_tracking: Optional[LoopLagTracking] = None,
+    ):
+        """
+        Initialization.
+
+        Parameters
+        ----------
+        interval: float, default=0.1
+            The time in seconds between two lag measurements.
+        threshold: float, default=0.25
+            The lag in seconds above which the loop is considered blocked and its stack captured.
+        report_interval: float, default=60.0
+            The time in seconds between two reports to the logs and metrics.
+        lag_tracking: Optional[LoopLagTracking], default=None
+            Where to export the reports. Reports are only logged if not provided.
+        """
+        self.interval = interval
+        self.threshold = threshold
+        self.report_interval = report_interval
+        self.lag_tracking = lag_tracking
+
+        self.histogram: List[int] = [0] * len(LAG_BUCKETS_MS)
+        self.max_lag = 0.0
+        self.offenders: Counter = Counter()
+        self.offender_lags: Dict[str, float] = {}
+
+        self._lock = threading.Lock()
+        self._last_beat = time.monotonic()
+        self._captured_beat: Optional[float] = None
+        self._pending_offender: Optional[str] = None
+        self._loop_thread_id: Optional[int] = None
+        self._stop_event = threading.Event()
+        self._monitor_thread: Optional[threading.Thread] = None
+        self._tasks: List[asyncio.Task] = []
+
+
+    def start(self, client) -> None:
+        """
+        Start the watchdog tasks and the monitor thread.
+
+        Parameters
+        ----------
+        client: discord.Client
+            The client whose loop is watched and whose gateway latency is reported.
+        """
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop_event.clear()
+        self._monitor_thread = threading.Thread(target=self._monitor, name="loop-watchdog", daemon=True)
+        self._monitor_thread.start()
+
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._measure()), loop.create_task(self._report(client))]
+
+
+    def stop(self) -> None:
+        """Stop the watchdog tasks and the monitor thread."""
+        self._stop_event.set()
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+
+    async def _measure(self) -> None:
+        """Continuously measure how late the loop wakes up the watchdog."""
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - started - self.interval, 0.0)
+            with self._lock:
+                self._last_beat = now
+                self._record_lag(lag)
+
+
+    def _record_lag(self, lag: float) -> None:
+        """Add a lag measurement to the histogram and attribute it to the captured offender, if any."""
+        lag_ms = lag * 1000
+        for i, bound in enumerate(LAG_BUCKETS_MS):
+            if lag_ms <= bound:
+                self.histogram[i] += 1
+                break
+        self.max_lag = max(self.max_lag, lag)
+
+        if self._pending_offender is not None:
+            offender = self._pending_offender
+            self._pending_offender = None
+            self.offenders[offender] += 1
+            self.offender_lags[offender] = max(self.offender_lags.get(offender, 0.0), lag)
+            logger.warning("Event loop blocked for %.3fs by %s.", lag, offender)
+
+
+    def _monitor(self) -> None:
+        """Capture the stack of the loop thread when it hasn't woken up the watchdog in time."""
+        while not self._stop_event.wait(self.threshold / 2):
+            with self._lock:
+                last_beat = self._last_beat
+                stalled = time.monotonic() - last_beat > self.threshold + self.interval
+                if not stalled or self._captured_beat == last_beat:
+                    continue
+                self._captured_beat = last_beat
+
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            del frame
+
+            offender = self._describe_offender(stack)
+            with self._lock:
+                self._pending_offender = offender
+            logger.warning(
+                "Event loop blocked for more than %.3fs in %s:\n%s",
+                self.threshold,
+                offender,
+                "".join(traceback.format_list(stack)),
+            )
+
+
+    @staticmethod
+    def _describe_offender(stack: traceback.StackSummary) -> str:
+        """Describe a blocking call by the innermost frame of the bot code and the innermost frame overall."""
+        innermost = stack[-1]
+        description = f"{innermost.name} ({os.path.basename(innermost.filename)}:{innermost.lineno})"
+        for frame in reversed(stack):
+            if frame.filename.startswith(PACKAGE_DIR) and not frame.filename.endswith("watchdog.py"):
+                if frame is not innermost:
+                    own = f"{frame.name} ({os.path.basename(frame.filename)}:{frame.lineno})"
+                    description = f"{own} -> {description}"
+                break
+        return description
+
+
+    async def _report(self, client) -> None:
+        """Periodically report the lag statistics and the gateway heartbeat latency."""
+        while True:
+            await asyncio.sleep(self.report_interval)
+            histogram, max_lag, worst_offenders = self._snapshot_and_reset()
+            samples = sum(histogram)
+            if samples == 0:
+                continue
+
+            gateway_latency = client.latency
+            offenders_summary = "; ".join(f"{name} x{count} ({lag:.3f}s)" for name, count, lag in worst_offenders)
+            percentiles = {p: self._percentile(histogram, p) for p in (50, 95, 99)}
+            logger.info(
+                "Loop lag over %d samples: p50<=%sms p95<=%sms p99<=%sms max=%.1fms, gateway latency=%.1fms, "
+                "worst offenders: %s",
+                samples,
+                percentiles[50],
+                percentiles[95],
+                percentiles[99],
+                max_lag * 1000,
+                gateway_latency * 1000,
+                offenders_summary or "none",
+            )
+            if self.lag_tracking is not None:
+                await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    self.lag_tracking.log_lag,
+                    samples,
+                    percentiles[50],
+                    percentiles[95],
+                    percentiles[99],
+                    max_lag * 1000,
+                    gateway_latency * 1000,
+                    offenders_summary,
+                    histogram,
+                )
+
+
+    def _snapshot_and_reset(self) -> Tuple[List[int], float, List[Tuple[str, int, float]]]:
+        """Return the statistics gathered since the last report and reset them."""
+        with self._lock:
+            histogram = self.histogram
+            max_lag = self.max_lag
+            worst_offenders = [
+                (name, count, self.offender_lags[name]) for name, count in self.offenders.most_common(5)
+            ]
+            self.histogram = [0] * len(LAG_BUCKETS_MS)
+            self.max_lag = 0.0
+            self.offenders = Counter()
+            self.offender_lags = {}
+        return histogram, max_lag, worst_offenders
+
+
+    @staticmethod
+    def _percentile(histogram: List[int], percentile: int) -> float:
+        """Get the upper bound of the bucket containing the given percentile."""
+        target = sum(histogram) * percentile / 100
+        cumulative = 0
+        for count, bound in zip(histogram, LAG_BUCKETS_MS):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return LAG_BUCKETS_MS[-1]
@@ -0,0 +1,90 @@
+# Copyright 2022 The Wordcab Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from discord_tldr.compaction import compact_transcript, polynomial_hash, rolling_hashes
+
+
+ANNOUNCEMENT = "Big announcement: the new release is out today, check the changelog!"
+
+
+def test_empty_messages_are_dropped():
+    lines, _ = compact_transcript([("a", "hello"), ("b", "   "), ("c", "🎉🎉"), ("d", "<:party:123456>")])
+    assert lines == ["a: hello"]
+
+
+def test_consecutive_messages_from_the_same_author_are_merged():
+    lines, _ = compact_transcript([("a", "first"), ("a", "second"), ("b", "third"), ("a", "fourth")])
+    assert lines == ["a: first second", "b: third", "a: fourth"]
+
+
+def test_runs_of_short_messages_are_collapsed():
+    lines, _ = compact_transcript([("a", "gm"), ("b", "GM!"), ("c", "gm"), ("d", "how is everyone?")])
+    assert lines == ["a: gm", "d: how is everyone?"]
+
+
+def test_short_answers_are_kept():
+    messages = [("b", "yes"), ("c", "did you deploy?"), ("a", "yes"), ("c", "ok"), ("b", "ok")]
+    lines, _ = compact_transcript(messages)
+    assert lines == ["b: yes", "c: did you deploy?", "a: yes", "c: ok"]
+
+
+def test_exact_and_near_duplicates_are_collapsed():
+    messages = [
+        ("a", ANNOUNCEMENT),
+        ("b", "nice"),
+        ("c", ANNOUNCEMENT.upper()),
+        ("d", ANNOUNCEMENT.replace("today", "today!!")),
+    ]
+    lines, _ = compact_transcript(messages)
+    assert lines == [f"a: {ANNOUNCEMENT}", "b: nice"]
+
+
+def test_duplicates_outside_the_window_are_kept():
+    messages = [("a", ANNOUNCEMENT), ("b", "something else entirely"), ("c", ANNOUNCEMENT)]
+    lines, _ = compact_transcript(messages, similarity_window=1)
+    assert lines == [f"a: {ANNOUNCEMENT}", "b: something else entirely", f"c: {ANNOUNCEMENT}"]
+
+
+def test_chars_saved():
+    messages = [("a", "gm"), ("b", "gm"), ("a", "hello   there")]
+    lines, chars_saved = compact_transcript(messages)
+    original_chars = sum(len(f"{author}: {content}") for author, content in messages)
+    assert chars_saved == original_chars - sum(len(line) for line in lines)
+    assert chars_saved > 0
+
+
+def test_rolling_hashes_match_direct_hashes():
+    text = "rolling hashes"
+    expected = {polynomial_hash(text[i : i + 5]) for i in range(len(text) - 4)}
+    assert rolling_hashes(text, 5) == expected
+
+
+def test_long_runs_from_the_same_author_are_truncated_to_the_budget():
+    messages = [("a", f"message number {i} with some padding text") for i in range(60)]
+    lines, _ = compact_transcript(messages, max_chars=500)
+    assert len(lines) == 1
+    assert len(lines[0]) == 500
+
+
+def test_compaction_stops_consuming_messages_once_the_budget_is_full():
+    consumed = []
+
+    def messages():
+        for i in range(1000):
+            consumed.append(i)
+            yield ("a" if i % 2 else "b", f"distinct message {i} about topic {i * 7}")
+
+    lines, _ = compact_transcript(messages(), max_chars=300)
+    assert sum(len(line) for line in lines) == 300
+    assert len(consumed) < 20